@@ -1,10 +1,10 @@
 import streamlit as st
 import os
 import asyncio
-import json
+import concurrent.futures
 from datetime import datetime
-import sqlite3
 
+import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
 from langchain_google_genai import ChatGoogleGenerativeAI
@@ -13,11 +13,27 @@ from pydantic import SecretStr
 import traceback
 import logging
 import io
-import requests
 import aiohttp
+import orjson
+import atexit
+import re
+import threading
 
 
-from src.utils import initialize_database, add_medicine, get_all_medicines, export_to_csv
+from src.utils import (
+    DB_PATH,
+    get_db_mtime,
+    initialize_database,
+    add_medicine,
+    add_medicines,
+    load_medicines_df,
+    export_to_csv,
+    get_cached_medicine,
+    cache_medicine,
+    cache_medicines,
+    is_write_query,
+    normalize_medicine_name,
+)
 from src.agent_runner import MedicineInfoAgent
 from src.models import Medicine  # Import the Medicine model
 from src.export_to_prolog import export_to_prolog  # Import the Prolog export function
@@ -32,6 +48,20 @@ load_dotenv()
 # Initialize database
 initialize_database()
 
+# MCP server endpoints
+READ_URL = "http://127.0.0.1:8000/mcp/read_query"
+WRITE_URL = "http://127.0.0.1:8000/mcp/write_query"
+BATCH_URL = "http://127.0.0.1:8000/mcp/batch"
+
+# Rows requested per page of MCP read results
+MCP_PAGE_SIZE = 1000
+
+# Seconds to wait for an MCP reply before giving up on it
+MCP_TIMEOUT = 60
+
+# Upper bound on browser agents running side by side for a multi-medicine search
+MAX_AGENT_CONCURRENCY = 5
+
 # Configure page settings
 st.set_page_config(
     page_title="Medicine Information Assistant",
@@ -40,9 +70,8 @@ st.set_page_config(
     initial_sidebar_state="expanded",
 )
 
-# Apply custom CSS
-st.markdown(
-    """
+# Custom CSS for the page
+_CSS = """
 <style>
     .main {
         padding: 2rem;
@@ -80,9 +109,15 @@ st.markdown(
         font-size: 0.8rem;
     }
 </style>
-""",
-    unsafe_allow_html=True,
-)
+"""
+
+# Collapse the stylesheet once per process instead of shipping the indented block every rerun
+@st.cache_resource(show_spinner=False)
+def _minified_css():
+    return re.sub(r"\s+", " ", _CSS).strip()
+
+# Apply custom CSS. Streamlit drops elements that a rerun doesn't emit, so this must run every time
+st.markdown(_minified_css(), unsafe_allow_html=True)
 
 # Initialize session state
 if "api_key" not in st.session_state:
@@ -91,114 +126,351 @@ if "messages" not in st.session_state:
     st.session_state.messages = []
 if "model_choice" not in st.session_state:
     st.session_state.model_choice = "Gemini"
-if "medicines" not in st.session_state:
-    st.session_state.medicines = []
 if "mcp_messages" not in st.session_state:
     st.session_state.mcp_messages = []
+if "mcp_next_page" not in st.session_state:
+    st.session_state.mcp_next_page = None
 
-# Function to check if Ollama is running
-def is_ollama_running():
+# Probe the local Ollama server over the pooled HTTP session
+async def _probe_ollama(session):
     try:
-        response = requests.get("http://localhost:11434/api/version", timeout=2)
-        return response.status_code == 200
+        async with session.get(
+            "http://localhost:11434/api/version", timeout=aiohttp.ClientTimeout(total=0.5)
+        ) as response:
+            return response.status == 200
     except Exception:
         return False
 
+# Function to check if Ollama is running (cached so reruns don't re-probe the server)
+@st.cache_data(ttl=15, show_spinner=False)
+def is_ollama_running():
+    return _run_async(_probe_ollama(_http_session()))
+
+# Build the LLM client once per (model, key) so its HTTP client is reused across reruns
+@st.cache_resource(show_spinner=False)
+def _llm(model_choice, api_key):
+    if model_choice == "Ollama":
+        return ChatOllama(model="llama3", num_ctx=32000)
+    return ChatGoogleGenerativeAI(
+        model="gemini-2.0-flash-exp", api_key=SecretStr(api_key)
+    )
+
 # Function to initialize LLM based on model choice
 def get_llm(model_choice="Gemini"):
     if model_choice == "Ollama":
         if not is_ollama_running():
             st.error("Ollama is not running. Please start Ollama and try again.")
             return None
-        return ChatOllama(model="llama3", num_ctx=32000)
+        return _llm(model_choice, "")
     else:  # Default to Gemini
         api_key = st.session_state.api_key
         if not api_key:
             st.error("Please enter your Gemini API key in the Settings section.")
             return None
-        return ChatGoogleGenerativeAI(
-            model="gemini-2.0-flash-exp", api_key=SecretStr(api_key)
-        )
+        return _llm(model_choice, api_key)
 
-# Function to run medicine info search
-async def search_medicine_info(medicine_name):
-    llm = get_llm(st.session_state.model_choice)
-    if not llm:
+# Build a Medicine from an agent result, or None if the agent found nothing
+def _build_medicine(medicine_name, result):
+    if not result:
         return None
+    logger.info(f"Agent returned results: {result}")
+    
+    # Create a new Medicine object
+    today = datetime.now().strftime("%Y-%m-%d")
+    
+    # Default values for required fields
+    name = result.get("name", medicine_name)
+    brand = result.get("brand", "N/A") 
+    category = result.get("category", "N/A")
+    dosage = result.get("dosage", "N/A")
+    
+    # Create medicine object with all required fields
+    medicine = Medicine(
+        name=name,
+        brand=brand,
+        price=0.0,  # Default price since not extracted
+        dosage=dosage,
+        form="Various",  # Default form
+        otc=False,  # Default to prescription required
+        description=f"Information extracted from drugs.com: {name} in category {category}",
+        side_effects="Please consult your healthcare provider for side effects information.",
+        category=category,
+        date_added=today
+    )
+    
+    # Log the created medicine object
+    logger.info(f"Created medicine object: {medicine.model_dump()}")
+    return medicine
+
+# Function to run medicine info search
+# Runs on the shared event loop, so it must not touch Streamlit state
+async def search_medicine_info(medicine_name, llm):
+    # Serve repeated lookups from the cache without calling the LLM
+    cached = get_cached_medicine(medicine_name)
+    if cached:
+        logger.info(f"Cache hit for {medicine_name}")
+        return cached
 
     agent = MedicineInfoAgent(llm=llm, medicine_name=medicine_name)
-    result = await agent.run()
+    medicine = _build_medicine(medicine_name, await agent.run())
+    if medicine:
+        # Add the medicine to the database
+        add_medicine(medicine)
+        cache_medicine(medicine_name, medicine)
+    
+    # Return the medicine for display
+    return medicine
+
+# Long-lived event loop shared by every rerun, so async resources survive between clicks
+@st.cache_resource(show_spinner=False)
+def _event_loop():
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="async-loop", daemon=True).start()
+    return loop
+
+# Run a coroutine on the shared event loop and wait for its result.
+# Pass a timeout to give up (and cancel the coroutine) instead of blocking the script forever
+def _run_async(coro, timeout=None):
+    future = asyncio.run_coroutine_threadsafe(coro, _event_loop())
+    try:
+        return future.result(timeout)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise
+
+async def _create_http_session():
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=32, ttl_dns_cache=300, keepalive_timeout=60),
+        timeout=aiohttp.ClientTimeout(total=30),
+    )
+
+def _close_http_session(session, loop):
+    """Close the pooled MCP session on its event loop at interpreter exit."""
+    if not session.closed and loop.is_running():
+        asyncio.run_coroutine_threadsafe(session.close(), loop).result(timeout=5)
+
+# Pooled HTTP session for MCP and Ollama requests, bound to the shared event loop
+@st.cache_resource(show_spinner=False)
+def _http_session():
+    loop = _event_loop()
+    session = _run_async(_create_http_session())
+    atexit.register(_close_http_session, session, loop)
+    return session
+
+class _NoMedicineFound(Exception):
+    """Raised by _cached_lookup so failed searches are not memoized."""
+
+# In-memory response cache in front of the SQLite cache and the agent
+@st.cache_data(ttl=3600, max_entries=512, show_spinner=False)
+def _cached_lookup(medicine_key, model_choice):
+    # A SQLite cache hit needs no LLM, so don't require one (or probe Ollama) first
+    medicine = get_cached_medicine(medicine_key)
+    if medicine is None:
+        llm = get_llm(model_choice)
+        medicine = _run_async(search_medicine_info(medicine_key, llm)) if llm else None
+    if medicine is None:
+        raise _NoMedicineFound(medicine_key)
+    return medicine
+
+# Look up a medicine by name, serving repeated queries from memory
+def lookup_medicine(medicine_name):
+    try:
+        return _cached_lookup(normalize_medicine_name(medicine_name), st.session_state.model_choice)
+    except _NoMedicineFound:
+        return None
+
+# Look up several medicines at once, running uncached searches concurrently
+def lookup_medicines(medicine_names):
+    keys = list(dict.fromkeys(normalize_medicine_name(name) for name in medicine_names))
+    if len(keys) == 1:
+        return [lookup_medicine(keys[0])]
+    
+    found = {key: get_cached_medicine(key) for key in keys}
+    misses = [key for key, medicine in found.items() if medicine is None]
+    if misses:
+        llm = get_llm(st.session_state.model_choice)
+        if llm:
+            # At most MAX_AGENT_CONCURRENCY browser agents run at once
+            results = _run_async(
+                MedicineInfoAgent.run_many(llm, misses, max_concurrency=MAX_AGENT_CONCURRENCY)
+            )
+            new_entries = []
+            for key, result in zip(misses, results):
+                # gather() hands back CancelledError too, which is not an Exception subclass
+                if isinstance(result, BaseException):
+                    logger.error("Search for %s failed: %s", key, result)
+                    continue
+                medicine = _build_medicine(key, result)
+                if medicine:
+                    found[key] = medicine
+                    new_entries.append((key, medicine))
+            
+            # One transaction per table for the whole batch instead of one per medicine
+            if new_entries:
+                add_medicines(medicine for _, medicine in new_entries)
+                cache_medicines(new_entries)
+    return [found[key] for key in keys]
 
+# Show one search result in the chat and record it in the history
+def render_search_result(result, extract_data):
     if result:
-        logger.info(f"Agent returned results: {result}")
-        
-        # Create a new Medicine object
-        today = datetime.now().strftime("%Y-%m-%d")
-        
-        # Default values for required fields
-        name = result.get("name", medicine_name)
-        brand = result.get("brand", "N/A") 
-        category = result.get("category", "N/A")
-        dosage = result.get("dosage", "N/A")
-        
-        # Create medicine object with all required fields
-        medicine = Medicine(
-            name=name,
-            brand=brand,
-            price=0.0,  # Default price since not extracted
-            dosage=dosage,
-            form="Various",  # Default form
-            otc=False,  # Default to prescription required
-            description=f"Information extracted from drugs.com: {name} in category {category}",
-            side_effects="Please consult your healthcare provider for side effects information.",
-            category=category,
-            date_added=today
-        )
-        
-        # Log the created medicine object
-        logger.info(f"Created medicine object: {medicine.model_dump()}")
+        if extract_data and hasattr(result, "medicines") and result.medicines:
+            # Process structured medicine data
+            medicine = result  
+            medicine_info = f"""
+            ### {medicine.name}
+            
+            **Brand**: {medicine.brand}  
+            **Price**: ${medicine.price:.2f}  
+            **Dosage**: {medicine.dosage}  
+            **Form**: {medicine.form}  
+            **Prescription Required**: {"No" if medicine.otc else "Yes"}
+            
+            **Description**:  
+            {medicine.description}
+            
+            **Side Effects**:  
+            {medicine.side_effects}
+            
+            **Category**: {medicine.category}
+            """
+            
+            # Add assistant message with structured data, dumped once for replay.
+            # Its position in the history keys the button, since names can repeat
+            medicine_dump = medicine.model_dump()
+            message_index = len(st.session_state.messages)
+            st.session_state.messages.append({
+                "role": "assistant", 
+                "content": medicine_info,
+                "medicine_data": medicine,
+                "medicine_data_dump": medicine_dump,
+            })
+            
+            # Show the result
+            st.markdown(medicine_info)
+            
+            with st.expander("View structured medicine data"):
+                st.json(medicine_dump)
+                if st.button("Add to Database", key=f"add_new_{message_index}"):
+                    try:
+                        add_medicine(medicine)
+                        st.success(f"Added {medicine.name} to database!")
+                    except Exception as e:
+                        st.error(f"Error adding medicine: {e}")
+        else:
+            # Handle unstructured result (narrative response)
+            response = "I couldn't find structured information about this medicine."
+            
+            if hasattr(result, "__iter__"):
+                # Try to extract narrative response from agent steps
+                for step in result:
+                    if isinstance(step, tuple) and len(step) > 1 and isinstance(step[1], dict) and "done" in step[1]:
+                        if isinstance(step, dict) and "action" in step:
+                            done_data = step["action"].get("done", {})
+                        else:
+                            done_data = {}
+                        if isinstance(done_data, dict) and done_data.get("success") and "text" in done_data:
+                            response = done_data["text"]
+                            break
+            
+            # Add assistant message without structured data
+            st.session_state.messages.append({
+                "role": "assistant", 
+                "content": response
+            })
+            
+            # Show the result
+            st.markdown(response)
+    else:
+        error_message = "Sorry, I couldn't find information about this medicine."
+        st.session_state.messages.append({"role": "assistant", "content": error_message})
+        st.markdown(error_message)
 
-        # Add the medicine to the database
-        add_medicine(medicine)
-        
-        # Automatically reload medicines list after adding to database
-        load_medicines()
-        
-        # Return the medicine for display
-        return medicine
+# POST a JSON payload to the MCP server and decode the reply
+async def _post_mcp(session, endpoint, payload):
+    # Send request to MCP server over the pooled keep-alive session
+    async with session.post(
+        endpoint,
+        data=orjson.dumps(payload),
+        headers={"Content-Type": "application/json"}
+    ) as response:
+        if response.status == 200:
+            return orjson.loads(await response.read())
+        else:
+            error_text = await response.text()
+            return {"error": f"Error {response.status}: {error_text}"}
+
+class _BatchedMCPClient:
+    """Coalesce MCP queries submitted within a short window into one batch request.
+
+    Every call to submit() waits up to `window` seconds for other queries to arrive.
+    A lone query goes to its usual read/write endpoint; several are sent together to
+    the batch endpoint and each caller gets its own element of the response.
+    """
+
+    def __init__(self, session, window=0.05):
+        self._session = session
+        self._window = window
+        self._pending = []
+        self._flusher = None
 
-    return None
+    async def submit(self, payload):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((payload, future))
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush())
+        return await future
+
+    async def _flush(self):
+        while self._pending:
+            await asyncio.sleep(self._window)
+            batch, self._pending = self._pending, []
+            try:
+                if len(batch) == 1:
+                    payload = batch[0][0]
+                    # Only statements that start with a write keyword go to the write endpoint
+                    endpoint = WRITE_URL if is_write_query(payload["query"]) else READ_URL
+                    responses = [await _post_mcp(self._session, endpoint, payload)]
+                else:
+                    queries = [{**p, "write": is_write_query(p["query"])} for p, _ in batch]
+                    reply = await _post_mcp(self._session, BATCH_URL, {"queries": queries})
+                    responses = reply.get("responses") or [reply] * len(batch)
+                if len(responses) != len(batch):
+                    raise RuntimeError(
+                        f"MCP batch returned {len(responses)} responses for {len(batch)} queries"
+                    )
+                for (_, future), response in zip(batch, responses):
+                    if not future.done():
+                        future.set_result(response)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                # Never leave a caller waiting, even if this task itself is cancelled
+                for _, future in batch:
+                    if not future.done():
+                        future.cancel()
+
+# Batching MCP client shared by all sessions, bound to the pooled HTTP session
+@st.cache_resource(show_spinner=False)
+def _mcp_client():
+    return _BatchedMCPClient(_http_session())
 
 # Function to run SQLite MCP query
-async def run_mcp_query(prompt):
+async def run_mcp_query(prompt, client, offset=0):
     """Execute a query on the SQLite database through the MCP server API.
 
     The function determines the appropriate endpoint based on the query type:
-    - Queries containing write operations (e.g., INSERT, UPDATE, DELETE, CREATE, ALTER, DROP) are sent to the write_query endpoint.
+    - Queries starting with a write operation (e.g., INSERT, UPDATE, DELETE, CREATE, ALTER, DROP) are sent to the write_query endpoint.
     - All other queries are sent to the read_query endpoint.
+    Queries that arrive within the client's batching window are sent together to the batch endpoint.
+    SELECT results are paged on the server, MCP_PAGE_SIZE rows at a time starting at `offset`.
 
     If the prompt is not a valid SQL query, an error message will be returned.
     """
-    # Default to read query endpoint since it's safer
-    endpoint = "http://127.0.0.1:8000/mcp/read_query"
-    
-    # Check if query is a write operation (INSERT, UPDATE, DELETE, etc.)
-    write_operations = ["INSERT", "UPDATE", "DELETE", "CREATE", "ALTER", "DROP"]
-    if any(op in prompt.upper() for op in write_operations):
-        endpoint = "http://127.0.0.1:8000/mcp/write_query"
-    
     try:
-        # Send request to MCP server
-        async with aiohttp.ClientSession() as session, session.post(
-            endpoint,
-            json={"query": prompt},
-            headers={"Content-Type": "application/json"}
-        ) as response:
-                if response.status == 200:
-                    return await response.json()
-                else:
-                    error_text = await response.text()
-                    return {"error": f"Error {response.status}: {error_text}"}
+        return await client.submit({"query": prompt, "limit": MCP_PAGE_SIZE, "offset": offset})
     except aiohttp.ClientConnectorError:
         return {
             "error": "Cannot connect to MCP server. Please make sure it's running with: uvicorn mcp_server:app --reload"
@@ -206,26 +478,212 @@ async def run_mcp_query(prompt):
     except Exception as e:
         return {"error": f"Error executing query: {str(e)}"}
 
-# Function to load medicines from database
-def load_medicines():
-    try:
-        medicines_db = get_all_medicines()
-        if medicines_db and medicines_db.medicines:
-            st.session_state.medicines = medicines_db.medicines
-            return True
-        return False
-    except Exception as e:
-        st.error(f"Error loading medicines: {e}")
-        return False
+# Build the assistant chat message for an MCP server response
+def _mcp_reply(result):
+    match result:
+        case {"error": error_message}:
+            # Handle error response
+            return {"role": "assistant", "content": f"Error: {error_message}"}
+        case {"results": [_, *_] as results}:
+            # Handle successful read_query response
+            # Rows arrive as lists; build the DataFrame once with the column names from the server
+            columns = result.get("columns") or None
+            df = pd.DataFrame(results, columns=columns)
+            
+            # Render the table through st.dataframe instead of a Markdown string
+            start = result.get("offset", 0)
+            content = f"**Query Results:** rows {start + 1}-{start + len(df)}"
+            if result.get("has_more"):
+                content += " (more rows available)"
+            return {"role": "assistant", "content": content, "dataframe": df}
+        case {"results": _}:
+            return {
+                "role": "assistant",
+                "content": "Query executed successfully, but no results were returned.",
+            }
+        case {"message": message}:
+            # Handle successful write_query response
+            return {"role": "assistant", "content": message}
+        case _:
+            # Fallback for unexpected response format
+            return {
+                "role": "assistant",
+                "content": f"Received response: {orjson.dumps(result, option=orjson.OPT_INDENT_2).decode()}",
+            }
+
+# Run an MCP query and append the exchange to the Tab 2 chat
+def handle_mcp_query(prompt, offset=0):
+    # Add user message
+    if offset:
+        st.session_state.mcp_messages.append({"role": "user", "content": f"Next page of: {prompt}"})
+    else:
+        st.session_state.mcp_messages.append({"role": "user", "content": prompt})
+    
+    # Show assistant is thinking
+    with st.chat_message("assistant"):
+        thinking = st.empty()
+        thinking.markdown("Processing your request...")
+        
+        try:
+            # Run MCP query
+            result = _run_async(run_mcp_query(prompt, _mcp_client(), offset), timeout=MCP_TIMEOUT)
+            
+            if result:
+                # Process the direct JSON response from the MCP server
+                reply = _mcp_reply(result)
+                st.session_state.mcp_messages.append(reply)
+                thinking.markdown(reply["content"])
+                if "dataframe" in reply:
+                    st.dataframe(reply["dataframe"], use_container_width=True)
+                
+                # Remember where the next page starts, if there is one
+                if result.get("has_more"):
+                    next_offset = result.get("offset", offset) + len(result["results"])
+                    st.session_state.mcp_next_page = {"prompt": prompt, "offset": next_offset}
+                else:
+                    st.session_state.mcp_next_page = None
+            else:
+                error_message = "Sorry, I couldn't process your request."
+                st.session_state.mcp_messages.append({"role": "assistant", "content": error_message})
+                thinking.markdown(error_message)
+        
+        except Exception as e:
+            error_message = f"Error processing MCP request: {str(e)}"
+            st.session_state.mcp_messages.append({"role": "assistant", "content": error_message})
+            thinking.markdown(error_message)
+            logger.exception("MCP request failed")
+            if st.session_state.get("debug"):
+                st.error(traceback.format_exc())
+
+# LLM backends offered in the settings panel
+MODEL_OPTIONS = ("Gemini", "Ollama")
+
+# Sort choices for the medicine table mapped to (column, ascending)
+SORT_OPTIONS = {
+    "Name": ("name", True),
+    "Price (Low to High)": ("price", True),
+    "Price (High to Low)": ("price", False),
+}
+
+# Row count from which the table filters switch from a boolean mask to DataFrame.query
+QUERY_MIN_ROWS = 10_000
+
+# Build the medicines DataFrame once per database revision, straight from SQLite
+@st.cache_data(show_spinner=False)
+def _medicines_df(db_mtime: float) -> pd.DataFrame:
+    # Low-cardinality text columns become categoricals; price and otc are typed by the query.
+    # name is Arrow-backed so sorting by it runs in C rather than comparing Python str objects
+    return load_medicines_df().astype(
+        {'name': 'string[pyarrow]', 'brand': 'category', 'form': 'category', 'category': 'category'}
+    )
+
+# Prolog export kept in memory and rebuilt only when the database changes
+@st.cache_data(show_spinner=False)
+def _prolog_bytes(db_mtime: float) -> bytes:
+    buf = io.StringIO()
+    export_to_prolog(DB_PATH, buf)
+    return buf.getvalue().encode("utf-8")
 
 # Define the get_selected_category function
 
 def get_selected_category(df):
     if 'category' in df.columns:
-        categories = ["All"] + sorted(df['category'].unique().tolist())
-        return st.selectbox("Filter by Category", categories, key="filter_category")
+        # Categorical columns already carry their sorted unique values
+        if isinstance(df['category'].dtype, pd.CategoricalDtype):
+            categories = df['category'].cat.categories
+        else:
+            categories = np.sort(df['category'].dropna().unique())
+        return st.selectbox("Filter by Category", ["All", *categories], key="filter_category")
     return "All"
 
+# Chat history for Tab 1. As a fragment, its "Add to Database" buttons only rerun this block
+@st.fragment
+def render_chat(messages):
+    for i, message in enumerate(messages):
+        with st.chat_message(message["role"]):
+            st.markdown(message["content"])
+            if message["role"] == "assistant" and "medicine_data" in message:
+                medicine_data = message["medicine_data"]
+                with st.expander("View structured medicine data"):
+                    # Use the dict captured when the message was created
+                    st.json(message.get("medicine_data_dump") or medicine_data.model_dump())
+                    if st.button("Add to Database", key=f"add_{i}"):
+                        try:
+                            add_medicine(medicine_data)
+                            # Rerun the whole app so the table fragment sees the new database mtime
+                            st.toast(f"Added {medicine_data.name} to database!")
+                            st.rerun()
+                        except Exception as e:
+                            st.error(f"Error adding medicine: {e}")
+
+# Chat history for Tab 2; it has no widgets, so it simply re-renders with the rest of the app
+def render_mcp_chat(messages):
+    for message in messages:
+        with st.chat_message(message["role"]):
+            st.markdown(message["content"])
+            if "dataframe" in message:
+                st.dataframe(message["dataframe"], use_container_width=True)
+
+# Medicine table, filters and export. Runs as a fragment so its widgets only rerun this block
+@st.fragment
+def _medicine_db_fragment():
+    st.subheader("Medicine Database")
+
+    df = _medicines_df(get_db_mtime())
+
+    if not df.empty:
+        # Filter options
+        filter_col1, filter_col2, filter_col3 = st.columns(3)
+        with filter_col1:
+            filter_otc = st.checkbox("OTC Only", value=False, key="filter_otc")
+        with filter_col2:
+            selected_category = get_selected_category(df)
+        with filter_col3:
+            sort_option = st.selectbox("Sort by", list(SORT_OPTIONS), key="sort_option")
+
+        # Apply filters. Large frames go through DataFrame.query, which uses numexpr when
+        # it is installed; small ones are cheaper with a plain boolean mask
+        if len(df) >= QUERY_MIN_ROWS:
+            conditions = []
+            if filter_otc:
+                conditions.append("otc")
+            if selected_category != "All":
+                conditions.append("category == @selected_category")
+            subset = df.query(" and ".join(conditions)) if conditions else df
+        else:
+            mask = np.ones(len(df), dtype=bool)
+            if filter_otc:
+                mask &= df['otc'].to_numpy(dtype=bool)
+            if selected_category != "All":
+                # Compare on the Series so a categorical column is matched by its integer codes
+                mask &= (df['category'] == selected_category).to_numpy()
+            subset = df.loc[mask]
+
+        # Apply sorting (filtering already returned a new frame)
+        sort_column, ascending = SORT_OPTIONS[sort_option]
+        filtered_df = subset.sort_values(
+            by=sort_column, ascending=ascending, kind="stable", ignore_index=True
+        )
+
+        # Display the filtered DataFrame
+        st.dataframe(filtered_df, use_container_width=True)
+
+        # Export options
+        export_col1, export_col2 = st.columns(2)
+        with export_col1:
+            if st.button("Export Filtered Data to CSV"):
+                # pandas encodes straight into the binary buffer, with no intermediate str
+                csv_buffer = io.BytesIO()
+                filtered_df.to_csv(csv_buffer, index=False, encoding="utf-8")
+                st.download_button(
+                    label="Download CSV",
+                    data=csv_buffer.getvalue(),
+                    file_name="filtered_medicines.csv",
+                    mime="text/csv",
+                )
+    else:
+        st.info("No medicines in database. Use the search function to add medicines.")
+
 # Sidebar
 with st.sidebar:
     st.title("Medicine Info Assistant")
@@ -241,27 +699,39 @@ with st.sidebar:
         )
         
         # Model selection dropdown
-        model_options = ["Gemini", "Ollama"]
         selected_model = st.selectbox(
             "Choose LLM Model",
-            options=model_options,
-            index=model_options.index(st.session_state.model_choice),
+            options=MODEL_OPTIONS,
+            index=MODEL_OPTIONS.index(st.session_state.model_choice),
             help="Select Gemini (cloud) or Ollama (local)",
             key="model_choice_select"
         )
         
+        st.checkbox(
+            "Debug tracebacks",
+            value=False,
+            key="debug",
+            help="Show full Python tracebacks when a request fails",
+        )
+        
         if st.button("Apply Settings"):
             st.session_state.api_key = st.session_state.input_api_key
             st.session_state.model_choice = st.session_state.model_choice_select
+            _llm.clear()
             st.success("Settings applied!")
 
     # Database section
     with st.expander("Database"):
         if st.button("Load Medicines"):
-            if load_medicines():
-                st.success(f"Loaded {len(st.session_state.medicines)} medicines!")
-            else:
-                st.warning("No medicines found in database.")
+            try:
+                # Served from the mtime-keyed DataFrame cache shared with the table
+                medicine_count = len(_medicines_df(get_db_mtime()))
+                if medicine_count:
+                    st.success(f"Loaded {medicine_count} medicines!")
+                else:
+                    st.warning("No medicines found in database.")
+            except Exception as e:
+                st.error(f"Error loading medicines: {e}")
                 
         if st.button("Export to CSV"):
             csv_path = export_to_csv()
@@ -278,17 +748,12 @@ with st.sidebar:
         
         if st.button("Export to Prolog"):
             try:
-                output_file = os.path.join(os.getcwd(), "medicines.pl")
-                export_to_prolog("medicine.db", output_file)
-                st.success(f"Exported medicine data to Prolog file: medicines.pl")
-                with open(output_file, "r") as f:
-                    prolog_content = f.read()
-                    st.download_button(
-                        label="Download Prolog File",
-                        data=prolog_content,
-                        file_name="medicines.pl",
-                        mime="text/plain"
-                    )
+                st.download_button(
+                    label="Download Prolog File",
+                    data=_prolog_bytes(get_db_mtime()),
+                    file_name="medicines.pl",
+                    mime="text/plain"
+                )
             except Exception as e:
                 st.error(f"Error exporting to Prolog: {e}")
 
@@ -320,169 +785,34 @@ with tab1:
         search_button = st.button("Search", type="primary", use_container_width=True)
     
     # Display chat history
-    for message in st.session_state.messages:
-        with st.chat_message(message["role"]):
-            st.markdown(message["content"])
-            if message["role"] == "assistant" and "medicine_data" in message:
-                medicine_data = message["medicine_data"]
-                with st.expander("View structured medicine data"):
-                    st.json(medicine_data.model_dump())
-                    if st.button("Add to Database", key=f"add_{medicine_data.name}"):
-                        try:
-                            add_medicine(medicine_data)
-                            st.success(f"Added {medicine_data.name} to database!")
-                            # Reload medicines list
-                            load_medicines()
-                        except Exception as e:
-                            st.error(f"Error adding medicine: {e}")
+    render_chat(st.session_state.messages)
     
     # Handle search button click
     if search_button and medicine_name:
         # Add user message
         st.session_state.messages.append({"role": "user", "content": f"Find information about {medicine_name}"})
         
-        # Show assistant is thinking
-        with st.chat_message("assistant"):
-            thinking = st.empty()
-            thinking.markdown("Searching for medicine information...")
+        try:
+            # Run medicine info search; comma-separated names are looked up concurrently
+            medicine_names = [name for name in medicine_name.split(",") if name.strip()]
+            with st.spinner("Searching for medicine information..."):
+                results = lookup_medicines(medicine_names)
             
-            try:
-                # Run medicine info search
-                result = asyncio.run(search_medicine_info(medicine_name))
-                
-                if result:
-                    if extract_data and hasattr(result, "medicines") and result.medicines:
-                        # Process structured medicine data
-                        medicine = result  
-                        medicine_info = f"""
-                        ### {medicine.name}
-                        
-                        **Brand**: {medicine.brand}  
-                        **Price**: ${medicine.price:.2f}  
-                        **Dosage**: {medicine.dosage}  
-                        **Form**: {medicine.form}  
-                        **Prescription Required**: {"No" if medicine.otc else "Yes"}
-                        
-                        **Description**:  
-                        {medicine.description}
-                        
-                        **Side Effects**:  
-                        {medicine.side_effects}
-                        
-                        **Category**: {medicine.category}
-                        """
-                        
-                        # Add assistant message with structured data
-                        st.session_state.messages.append({
-                            "role": "assistant", 
-                            "content": medicine_info,
-                            "medicine_data": medicine
-                        })
-                        
-                        # Update the thinking message with the result
-                        thinking.markdown(medicine_info)
-                        
-                        with st.expander("View structured medicine data"):
-                            st.json(medicine.model_dump())
-                            if st.button("Add to Database"):
-                                try:
-                                    add_medicine(medicine)
-                                    st.success(f"Added {medicine.name} to database!")
-                                    # Reload medicines list
-                                    load_medicines()
-                                except Exception as e:
-                                    st.error(f"Error adding medicine: {e}")
-                    else:
-                        # Handle unstructured result (narrative response)
-                        response = "I couldn't find structured information about this medicine."
-                        
-                        if hasattr(result, "__iter__"):
-                            # Try to extract narrative response from agent steps
-                            for step in result:
-                                if isinstance(step, tuple) and len(step) > 1 and isinstance(step[1], dict) and "done" in step[1]:
-                                    if isinstance(step, dict) and "action" in step:
-                                        done_data = step["action"].get("done", {})
-                                    else:
-                                        done_data = {}
-                                    if isinstance(done_data, dict) and done_data.get("success") and "text" in done_data:
-                                        response = done_data["text"]
-                                        break
-                        
-                        # Add assistant message without structured data
-                        st.session_state.messages.append({
-                            "role": "assistant", 
-                            "content": response
-                        })
-                        
-                        # Update the thinking message with the result
-                        thinking.markdown(response)
-                else:
-                    error_message = "Sorry, I couldn't find information about this medicine."
-                    st.session_state.messages.append({"role": "assistant", "content": error_message})
-                    thinking.markdown(error_message)
-            
-            except Exception as e:
-                error_message = f"Error searching for medicine information: {str(e)}"
-                st.session_state.messages.append({"role": "assistant", "content": error_message})
-                thinking.markdown(error_message)
+            for result in results:
+                with st.chat_message("assistant"):
+                    render_search_result(result, extract_data)
+        
+        except Exception as e:
+            error_message = f"Error searching for medicine information: {str(e)}"
+            st.session_state.messages.append({"role": "assistant", "content": error_message})
+            with st.chat_message("assistant"):
+                st.markdown(error_message)
+            logger.exception("Medicine search failed")
+            if st.session_state.get("debug"):
                 st.error(traceback.format_exc())
     
     # Display medicine database
-    st.subheader("Medicine Database")
-    
-    # Load medicines if not already loaded
-    if not st.session_state.medicines:
-        load_medicines()
-    
-    if st.session_state.medicines:
-        # Convert to DataFrame for display
-        medicines_data = [m.model_dump() for m in st.session_state.medicines]
-        df = pd.DataFrame(medicines_data)
-        
-        # Filter options
-        filter_col1, filter_col2, filter_col3 = st.columns(3)
-        with filter_col1:
-            filter_otc = st.checkbox("OTC Only", value=False, key="filter_otc")
-        with filter_col2:
-            selected_category = get_selected_category(df)
-        with filter_col3:
-            sort_option = st.selectbox("Sort by", ["Name", "Price (Low to High)", "Price (High to Low)"], key="sort_option")
-        
-        # Apply filters
-        filtered_df = df.copy()
-        
-        if filter_otc:
-            filtered_df = filtered_df[filtered_df['otc']]
-            
-        if selected_category != "All":
-            filtered_df = filtered_df[filtered_df['category'] == selected_category]
-            
-        # Apply sorting
-        if sort_option == "Name":
-            filtered_df = filtered_df.sort_values(by="name")
-        elif sort_option == "Price (Low to High)":
-            filtered_df = filtered_df.sort_values(by="price")
-        elif sort_option == "Price (High to Low)":
-            filtered_df = filtered_df.sort_values(by="price", ascending=False)
-        
-        # Display the filtered DataFrame
-        st.dataframe(filtered_df, use_container_width=True)
-        
-        # Export options
-        export_col1, export_col2 = st.columns(2)
-        with export_col1:
-            if st.button("Export Filtered Data to CSV"):
-                csv_buffer = io.StringIO()
-                filtered_df.to_csv(csv_buffer, index=False)
-                csv_data = csv_buffer.getvalue().encode("utf-8")
-                st.download_button(
-                    label="Download CSV",
-                    data=csv_data,
-                    file_name="filtered_medicines.csv",
-                    mime="text/csv",
-                )
-    else:
-        st.info("No medicines in database. Use the search function to add medicines.")
+    _medicine_db_fragment()
 
 # Tab 2: SQLite MCP Server
 with tab2:
@@ -511,76 +841,16 @@ with tab2:
     mcp_button = st.button("Run MCP Query", type="primary")
     
     # Display MCP chat history
-    for message in st.session_state.mcp_messages:
-        with st.chat_message(message["role"]):
-            st.markdown(message["content"])
+    render_mcp_chat(st.session_state.mcp_messages)
     
     # Handle MCP button click
     if mcp_button and mcp_prompt:
-        # Add user message
-        st.session_state.mcp_messages.append({"role": "user", "content": mcp_prompt})
-        
-        # Show assistant is thinking
-        with st.chat_message("assistant"):
-            thinking = st.empty()
-            thinking.markdown("Processing your request...")
-            
-            try:
-                # Run MCP query
-                result = asyncio.run(run_mcp_query(mcp_prompt))
-                
-                if result:
-                    # Process the direct JSON response from the MCP server
-                    if "error" in result:
-                        # Handle error response
-                        error_message = result["error"]
-                        st.session_state.mcp_messages.append({"role": "assistant", "content": f"Error: {error_message}"})
-                        thinking.markdown(f"Error: {error_message}")
-                    elif "results" in result:
-                        # Handle successful read_query response
-                        results = result["results"]
-                        if results:
-                            # Convert results to DataFrame for better display
-                            # First, get column names from the database
-                            conn = sqlite3.connect('medicine.db')
-                            cursor = conn.cursor()
-                            cursor.execute(f"PRAGMA table_info(medicines)")
-                            columns = [info[1] for info in cursor.fetchall()]
-                            conn.close()
-                            
-                            # Create DataFrame with column names
-                            df = pd.DataFrame(results, columns=columns)
-                            
-                            # Format response
-                            response = "**Query Results:**\n\n"
-                            response += df.to_markdown()
-                            
-                            st.session_state.mcp_messages.append({"role": "assistant", "content": response})
-                            thinking.markdown(response)
-                        else:
-                            response = "Query executed successfully, but no results were returned."
-                            st.session_state.mcp_messages.append({"role": "assistant", "content": response})
-                            thinking.markdown(response)
-                    elif "message" in result:
-                        # Handle successful write_query response
-                        message = result["message"]
-                        st.session_state.mcp_messages.append({"role": "assistant", "content": message})
-                        thinking.markdown(message)
-                    else:
-                        # Fallback for unexpected response format
-                        response = f"Received response: {json.dumps(result, indent=2)}"
-                        st.session_state.mcp_messages.append({"role": "assistant", "content": response})
-                        thinking.markdown(response)
-                else:
-                    error_message = "Sorry, I couldn't process your request."
-                    st.session_state.mcp_messages.append({"role": "assistant", "content": error_message})
-                    thinking.markdown(error_message)
-            
-            except Exception as e:
-                error_message = f"Error processing MCP request: {str(e)}"
-                st.session_state.mcp_messages.append({"role": "assistant", "content": error_message})
-                thinking.markdown(error_message)
-                st.error(traceback.format_exc())
+        handle_mcp_query(mcp_prompt)
+    
+    # Offer the next page of the last paged result
+    next_page = st.session_state.mcp_next_page
+    if next_page and st.button("Next page", key="mcp_next_page_button"):
+        handle_mcp_query(next_page["prompt"], next_page["offset"])
 
 # Footer
 st.markdown("---")
@@ -0,0 +1,4 @@
+# Root conftest: keeps the repository root on sys.path so tests can import the src package
+
+# test_navigation.py is a manual browser_use demo script, not a test module
+collect_ignore = ["test_navigation.py"]
@@ -1,36 +1,133 @@
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, Field
+from typing import Any, List, Optional, Tuple
+from contextlib import contextmanager
 import sqlite3
 import os
+import threading
 
-# Initialize FastAPI app
-app = FastAPI()
+# Initialize FastAPI app, serializing responses with orjson
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Path to the SQLite database
 db_path = os.path.join(os.getcwd(), "medicine.db")
 
+# Two connections per worker thread (read-write and query-only), reused across requests
+_tls = threading.local()
+
+def _open_conn():
+    """Open a SQLite connection in autocommit mode with the server's PRAGMAs applied."""
+    conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+    # Set row_factory to return dictionary-like rows
+    conn.row_factory = sqlite3.Row
+    conn.executescript(
+        "PRAGMA journal_mode=WAL;"
+        "PRAGMA synchronous=NORMAL;"
+        "PRAGMA busy_timeout=5000;"
+        "PRAGMA cache_size=-65536;"
+        "PRAGMA temp_store=MEMORY;"
+        "PRAGMA mmap_size=268435456;"
+    )
+    return conn
+
+def get_conn():
+    """Return this thread's read-write SQLite connection, opening it on first use."""
+    if not hasattr(_tls, "conn"):
+        _tls.conn = _open_conn()
+    return _tls.conn
+
+def get_read_conn():
+    """Return this thread's query-only SQLite connection, opening it on first use.
+
+    Statements that would modify the database fail on this connection instead of
+    being committed by autocommit.
+    """
+    if not hasattr(_tls, "read_conn"):
+        conn = _open_conn()
+        conn.execute("PRAGMA query_only=ON")
+        _tls.read_conn = conn
+    return _tls.read_conn
+
 # Define Pydantic models for request bodies
 class QueryRequest(BaseModel):
     query: str
+    # Optional rows of parameters; the query is run once per row in a single transaction
+    params: Optional[List[List[Any]]] = None
+    # Page window over the rows a read returns; limit=None returns every row
+    limit: Optional[int] = Field(1000, ge=1)
+    offset: int = Field(0, ge=0)
+
+class BulkRequest(BaseModel):
+    statements: List[Tuple[str, List[List[Any]]]]
+
+class BatchQuery(QueryRequest):
+    write: bool = False
+
+class BatchRequest(BaseModel):
+    queries: List[BatchQuery]
+
+# Rows discarded per fetchmany call while skipping to the requested offset
+_SKIP_BATCH = 1000
+
+def _run_read(query, limit=None, offset=0):
+    cursor = get_read_conn().cursor()
+    # Plain tuples instead of sqlite3.Row; column names are sent once alongside the rows
+    cursor.row_factory = None
+    # Run the SQL exactly as written and page over the cursor, so comments,
+    # trailing semicolons and duplicate column names all behave as they do in sqlite3
+    cursor.execute(query)
+    if limit is None:
+        results = cursor.fetchall()
+        has_more = False
+    else:
+        skipped = 0
+        while skipped < offset:
+            skipped_rows = cursor.fetchmany(min(offset - skipped, _SKIP_BATCH))
+            if not skipped_rows:
+                break
+            skipped += len(skipped_rows)
+        # Fetch one extra row to tell whether another page exists
+        results = cursor.fetchmany(limit + 1)
+        has_more = len(results) > limit
+        results = results[:limit]
+    columns = [d[0] for d in cursor.description or ()]
+    
+    return {
+        "results": results,
+        "columns": columns,
+        "offset": offset,
+        "has_more": has_more,
+    }
+
+@contextmanager
+def _transaction(conn):
+    """Group statements on an autocommit connection into one transaction."""
+    conn.execute("BEGIN")
+    try:
+        yield conn
+        conn.execute("COMMIT")
+    except BaseException:
+        # A failed COMMIT can leave this thread's connection inside the transaction
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+
+def _run_write(query, params=None):
+    conn = get_conn()
+    if params is None:
+        # The connection is in autocommit mode, so the statement is committed on execute
+        conn.execute(query)
+    else:
+        with _transaction(conn):
+            conn.executemany(query, params)
+    return {"message": "Query executed successfully."}
 
 @app.post("/mcp/read_query")
 def read_query(request: QueryRequest):
     """Endpoint to execute SELECT queries on the SQLite database."""
     try:
-        conn = sqlite3.connect(db_path)
-        # Set row_factory to return dictionary-like rows
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute(request.query)
-        results = cursor.fetchall()
-        
-        # Convert results to a list of dictionaries
-        formatted_results = []
-        for row in results:
-            formatted_results.append({key: row[key] for key in row.keys()})
-        
-        conn.close()
-        return {"results": formatted_results}
+        return _run_read(request.query, request.limit, request.offset)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -38,11 +135,32 @@ def read_query(request: QueryRequest):
 def write_query(request: QueryRequest):
     """Endpoint to execute INSERT, UPDATE, or DELETE queries on the SQLite database."""
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute(request.query)
-        conn.commit()
-        conn.close()
-        return {"message": "Query executed successfully."}
+        return _run_write(request.query, request.params)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/mcp/bulk_write")
+def bulk_write(request: BulkRequest):
+    """Endpoint to execute many parameterized write statements and commit them once."""
+    try:
+        conn = get_conn()
+        with _transaction(conn):
+            for query, params in request.statements:
+                conn.executemany(query, params)
+        return {"message": f"Executed {len(request.statements)} statements successfully."}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/mcp/batch")
+def batch_query(request: BatchRequest):
+    """Endpoint to execute several queries in one request, returning one response per query."""
+    responses = []
+    for item in request.queries:
+        try:
+            if item.write:
+                responses.append(_run_write(item.query, item.params))
+            else:
+                responses.append(_run_read(item.query, item.limit, item.offset))
+        except Exception as e:
+            responses.append({"error": str(e)})
+    return {"responses": responses}
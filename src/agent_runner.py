@@ -1,65 +1,115 @@
+import asyncio
 import json
 import logging
-import traceback
+from functools import lru_cache
+from typing import Optional
 
+import orjson
 from browser_use import Agent
 
 logger = logging.getLogger(__name__)
 
+_DECODER = json.JSONDecoder()
+
+def _decode_first_json_object(text: str) -> Optional[dict]:
+    """Return the first JSON object embedded in text, or None if there is none.
+
+    Tries raw_decode at each '{' in turn, so the object is parsed in place
+    without slicing it out of the text first.
+    """
+    idx = text.find("{")
+    while idx != -1:
+        try:
+            return _DECODER.raw_decode(text, idx)[0]
+        except json.JSONDecodeError:
+            idx = text.find("{", idx + 1)
+    return None
+
+@lru_cache(maxsize=1024)
+def _build_task_cached(medicine_name: str) -> str:
+    # Task to navigate to drugs.com and extract required information
+    task = f"""
+    Navigate to https://drugs.com/{medicine_name}.html.
+    wait 2 seconds
+    Extract the following information from the page:
+    - Generic name
+    - Brand names
+    - Dosage forms
+    - Drug class
+    Format the extracted information into a structured JSON object with the following keys:
+    {{
+        "generic_name": "",
+        "brand_names": "",
+        "dosage_forms": "",
+        "drug_class": ""
+    }}
+    If any of the fields are not available, use "N/A" as the value.
+    """
+    return task
+
+# Keys of the JSON object the task asks the agent to produce
+_EXPECTED_KEYS = {"generic_name", "brand_names", "dosage_forms", "drug_class"}
+
 class MedicineInfoAgent:
     def __init__(self, llm, medicine_name: str):
         self.llm = llm
         self.medicine_name = medicine_name
 
     def _build_task(self) -> str:
-        # Task to navigate to drugs.com and extract required information
-        task = f"""
-        Navigate to https://drugs.com/{self.medicine_name}.html.
-        wait 2 seconds
-        Extract the following information from the page:
-        - Generic name
-        - Brand names
-        - Dosage forms
-        - Drug class
-        Format the extracted information into a structured JSON object with the following keys:
-        {{
-            "generic_name": "",
-            "brand_names": "",
-            "dosage_forms": "",
-            "drug_class": ""
-        }}
-        If any of the fields are not available, use "N/A" as the value.
-        """
-        return task
+        return _build_task_cached(self.medicine_name)
 
     async def run(self):
         task = self._build_task()
+        found = {}
+
+        def on_step(*_):
+            # Stop as soon as an earlier step extracted the complete JSON we asked for
+            state = getattr(agent, "state", None)
+            for action_result in getattr(state, "last_result", None) or ():
+                data = _decode_first_json_object(getattr(action_result, "extracted_content", None) or "")
+                if data and _EXPECTED_KEYS <= data.keys():
+                    found["data"] = data
+                    agent.stop()
+                    return
+
         agent = Agent(
             task=task,
             llm=self.llm,
             max_actions_per_step=5,
+            register_new_step_callback=on_step,
         )
 
         result = await agent.run(max_steps=50)
-        return self._process_result(result)
+        return self._process_result(result, found.get("data"))
+
+    @classmethod
+    async def run_many(cls, llm, medicine_names, max_concurrency: int = 5):
+        """Run one agent per medicine name, at most max_concurrency at a time.
+
+        Results come back in input order; a failed run is returned as its exception.
+        """
+        sem = asyncio.Semaphore(max_concurrency)
+
+        async def _run_one(medicine_name):
+            async with sem:
+                return await cls(llm, medicine_name).run()
+
+        return await asyncio.gather(
+            *(_run_one(name) for name in medicine_names), return_exceptions=True
+        )
 
-    def _process_result(self, result):
-        """Process the structured result from the agent"""
+    def _process_result(self, result, data=None):
+        """Process the structured result from the agent, or the data extracted before it stopped"""
         try:
-            data = None
             # Check if the result contains the expected JSON structure
-            if hasattr(result, "final_result") and callable(getattr(result, "final_result")):
+            if data is None and hasattr(result, "final_result") and callable(getattr(result, "final_result")):
                 final_result = result.final_result()
                 if final_result:
                     # Extract JSON from the final result text
                     # First try to find a JSON string within the text
-                    import re
-                    json_match = re.search(r'\{.*\}', final_result, re.DOTALL)
-                    if json_match:
-                        try:
-                            data = json.loads(json_match.group(0))
-                        except json.JSONDecodeError:
-                            logger.warning("Found JSON-like text but couldn't parse it")
+                    data = _decode_first_json_object(final_result)
+                    if data is None and "{" in final_result:
+                        logger.warning("Found JSON-like text but couldn't parse it")
             
             # Fallback: Try to extract JSON from the agent's steps
             if data is None and hasattr(result, "__iter__"):
@@ -69,16 +119,14 @@ class MedicineInfoAgent:
                         if isinstance(done_data, dict) and done_data.get("success") and "text" in done_data:
                             try:
                                 # Look for JSON within the text
-                                import re
-                                json_match = re.search(r'\{.*\}', done_data["text"], re.DOTALL)
-                                if json_match:
-                                    data = json.loads(json_match.group(0))
+                                data = _decode_first_json_object(done_data["text"])
+                                if data is not None:
                                     break
                                 
                                 # If no JSON pattern found, try parsing the entire text
-                                data = json.loads(done_data["text"])
+                                data = orjson.loads(done_data["text"])
                                 break
-                            except json.JSONDecodeError:
+                            except orjson.JSONDecodeError:
                                 # Try to extract from Step 3 extraction content
                                 continue
             
@@ -107,6 +155,5 @@ class MedicineInfoAgent:
 
             return None
         except Exception as e:
-            logger.error(f"Error processing result: {str(e)}")
-            logger.error(traceback.format_exc())
+            logger.exception("Error processing result: %s", e)
             return None
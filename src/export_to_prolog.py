@@ -1,23 +1,40 @@
 import sqlite3
+from contextlib import closing
+
+_PROLOG_BOOL = ("false", "true")
+
+# Quoted atoms need backslashes and single quotes escaped
+_ESC = str.maketrans({"'": "\\'", "\\": "\\\\"})
+
+_FACT_TEMPLATE = "medicine('%s', '%s', %s, '%s', '%s', %s, '%s', '%s', '%s').\n"
+
+def _atom(value):
+    return str(value).translate(_ESC)
 
 def export_to_prolog(db_path, output_file):
     """Export medicines database to a Prolog knowledge base."""
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-
-    # Query all medicines
-    cursor.execute("SELECT name, brand, price, dosage, form, otc, description, side_effects, category FROM medicines")
-    rows = cursor.fetchall()
-
-    with open(output_file, "w") as f:
-        f.write("% Prolog knowledge base for medicines\n")
-        for row in rows:
-            name, brand, price, dosage, form, otc, description, side_effects, category = row
-            prolog_fact = f"medicine('{name}', '{brand}', {price}, '{dosage}', '{form}', {str(bool(otc)).lower()}, '{description}', '{side_effects}', '{category}').\n"
-            f.write(prolog_fact)
-
-    conn.close()
-    print(f"Prolog knowledge base exported to {output_file}")
+    # Read-only connection; facts are written straight from the cursor
+    with closing(sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, isolation_level=None)) as conn:
+        # Query all medicines
+        cursor = conn.execute("SELECT name, brand, price, dosage, form, otc, description, side_effects, category FROM medicines")
+
+        # output_file may be a path or an already-open text stream (e.g. io.StringIO)
+        if hasattr(output_file, "write"):
+            _write_facts(output_file, cursor)
+        else:
+            with open(output_file, "w") as f:
+                _write_facts(f, cursor)
+            print(f"Prolog knowledge base exported to {output_file}")
+
+def _write_facts(f, rows):
+    f.write("% Prolog knowledge base for medicines\n")
+    f.writelines(
+        _FACT_TEMPLATE % (
+            _atom(name), _atom(brand), price, _atom(dosage), _atom(form), _PROLOG_BOOL[bool(otc)],
+            _atom(description), _atom(side_effects), _atom(category),
+        )
+        for name, brand, price, dosage, form, otc, description, side_effects, category in rows
+    )
 
 # Example usage
 if __name__ == "__main__":
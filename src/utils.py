@@ -1,150 +1,395 @@
+import csv
 import os
+import queue
+import re
 import sqlite3
-import pandas as pd
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Iterable, Optional, Tuple
 from datetime import datetime
 from src.models import Medicine, MedicineDatabase, MedicineInsight
 
+if TYPE_CHECKING:
+    import pandas as pd
+
+try:
+    import hyperscan
+except ImportError:  # optional, falls back to the re module
+    hyperscan = None
+
+# Path to the SQLite database
+DB_PATH = 'medicine.db'
+
+# Columns of the medicines table that map onto the Medicine model
+MEDICINE_COLUMNS = (
+    'name', 'brand', 'price', 'dosage', 'form', 'otc',
+    'description', 'side_effects', 'category', 'date_added',
+)
+
+_INSERT_MEDICINE_SQL = (
+    f"INSERT INTO medicines ({', '.join(MEDICINE_COLUMNS)}) "
+    f"VALUES ({', '.join('?' * len(MEDICINE_COLUMNS))})"
+)
+
+# Per-connection tuning; journal_mode=WAL is persistent and set in initialize_database
+_CONNECTION_PRAGMAS = """
+PRAGMA synchronous=NORMAL;
+PRAGMA busy_timeout=5000;
+PRAGMA cache_size=-20000;
+PRAGMA temp_store=MEMORY;
+PRAGMA foreign_keys=ON;
+"""
+
+
+def _connect(read_only: bool = False) -> sqlite3.Connection:
+    """Open a connection to the database with the standard PRAGMAs applied."""
+    if read_only:
+        conn = sqlite3.connect(
+            f'file:{DB_PATH}?mode=ro', uri=True, isolation_level=None, check_same_thread=False
+        )
+    else:
+        conn = sqlite3.connect(DB_PATH, isolation_level=None, check_same_thread=False)
+    conn.executescript(_CONNECTION_PRAGMAS)
+    return conn
+
+
+# Number of read-only connections kept open for queries
+_READ_POOL_SIZE = 8
+
+# A single writer connection serialized by a lock, plus a pool of readers
+_write_conn = None
+_write_lock = threading.Lock()
+_read_pool = None
+_read_pool_lock = threading.Lock()
+
+
+def _get_write_conn() -> sqlite3.Connection:
+    """Return the shared writer connection. Callers must hold _write_lock."""
+    global _write_conn
+    if _write_conn is None:
+        _write_conn = _connect()
+    return _write_conn
+
+
+@contextmanager
+def _write_transaction():
+    """Run a block of writes inside a single BEGIN IMMEDIATE transaction."""
+    with _write_lock:
+        conn = _get_write_conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+            conn.execute('COMMIT')
+        except BaseException:
+            # A failed COMMIT can leave the transaction open on the shared writer
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+
+
+@contextmanager
+def _borrow_read():
+    """Borrow a read-only connection from the pool for the duration of a block."""
+    global _read_pool
+    if _read_pool is None:
+        with _read_pool_lock:
+            if _read_pool is None:
+                pool = queue.Queue()
+                for _ in range(_READ_POOL_SIZE):
+                    pool.put(_connect(read_only=True))
+                _read_pool = pool
+    conn = _read_pool.get()
+    try:
+        yield conn
+    finally:
+        _read_pool.put(conn)
+
+
+def get_db_mtime() -> float:
+    """Return the last modification time of the database, including its WAL file."""
+    mtime = os.path.getmtime(DB_PATH)
+    wal_path = DB_PATH + '-wal'
+    if os.path.exists(wal_path):
+        mtime = max(mtime, os.path.getmtime(wal_path))
+    return mtime
+
 
 def initialize_database():
     """Initialize the SQLite database with necessary tables if they don't exist."""
-    conn = sqlite3.connect('medicine.db')
-    cursor = conn.cursor()
-    
-    # Create medicines table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS medicines (
-        id INTEGER PRIMARY KEY,
-        name TEXT NOT NULL,
-        brand TEXT NOT NULL,
-        price REAL NOT NULL,
-        dosage TEXT NOT NULL,
-        form TEXT NOT NULL,
-        otc INTEGER NOT NULL,
-        description TEXT NOT NULL,
-        side_effects TEXT NOT NULL,
-        category TEXT NOT NULL,
-        date_added TEXT NOT NULL
-    )
-    ''')
-    
-    # Create insights table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS insights (
-        id INTEGER PRIMARY KEY,
-        insight TEXT NOT NULL,
-        category TEXT NOT NULL,
-        date_created TEXT NOT NULL
+    with _write_lock:
+        # WAL lets readers proceed while a write is in progress
+        _get_write_conn().execute('PRAGMA journal_mode=WAL')
+
+    with _write_transaction() as conn:
+        cursor = conn.cursor()
+        
+        # Create medicines table
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS medicines (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            brand TEXT NOT NULL,
+            price REAL NOT NULL,
+            dosage TEXT NOT NULL,
+            form TEXT NOT NULL,
+            otc INTEGER NOT NULL,
+            description TEXT NOT NULL,
+            side_effects TEXT NOT NULL,
+            category TEXT NOT NULL,
+            date_added TEXT NOT NULL
+        )
+        ''')
+        
+        # Create insights table
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS insights (
+            id INTEGER PRIMARY KEY,
+            insight TEXT NOT NULL,
+            category TEXT NOT NULL,
+            date_created TEXT NOT NULL
+        )
+        ''')
+        
+        # Create cache table for agent search results
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS medicine_cache (
+            norm_name TEXT PRIMARY KEY,
+            medicine_json TEXT NOT NULL,
+            ts REAL NOT NULL
+        )
+        ''')
+        
+        # Indexes for lookups by name and filtering by category
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_medicines_name ON medicines(name)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_medicines_category ON medicines(category)')
+
+
+def _medicine_row(medicine: Medicine) -> tuple:
+    """Convert a Medicine into a row tuple ordered like MEDICINE_COLUMNS."""
+    return (
+        medicine.name,
+        medicine.brand,
+        medicine.price,
+        medicine.dosage,
+        medicine.form,
+        1 if medicine.otc else 0,
+        medicine.description,
+        medicine.side_effects,
+        medicine.category,
+        medicine.date_added
     )
-    ''')
-    
-    conn.commit()
-    conn.close()
+
+
+def add_medicines(medicines: Iterable[Medicine]):
+    """Add several medicines to the database in a single transaction."""
+    with _write_transaction() as conn:
+        conn.executemany(_INSERT_MEDICINE_SQL, map(_medicine_row, medicines))
 
 
 def add_medicine(medicine: Medicine):
     """Add a medicine to the database."""
-    conn = sqlite3.connect('medicine.db')
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        '''
-        INSERT INTO medicines 
-        (name, brand, price, dosage, form, otc, description, side_effects, category, date_added) 
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''',
-        (
-            medicine.name,
-            medicine.brand,
-            medicine.price,
-            medicine.dosage,
-            medicine.form,
-            1 if medicine.otc else 0,
-            medicine.description,
-            medicine.side_effects,
-            medicine.category,
-            medicine.date_added
-        )
-    )
-    
-    conn.commit()
-    conn.close()
+    add_medicines([medicine])
 
 
 def get_all_medicines() -> MedicineDatabase:
     """Retrieve all medicines from the database."""
-    conn = sqlite3.connect('medicine.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT * FROM medicines')
-    rows = cursor.fetchall()
+    with _borrow_read() as conn:
+        cursor = conn.execute(f"SELECT {', '.join(MEDICINE_COLUMNS)} FROM medicines")
+        rows = cursor.fetchall()
     
+    # Rows come from our own schema, so skip pydantic validation
     medicines = []
-    for row in rows:
+    for name, brand, price, dosage, form, otc, description, side_effects, category, date_added in rows:
         medicines.append(
-            Medicine(
-                name=row['name'],
-                brand=row['brand'],
-                price=row['price'],
-                dosage=row['dosage'],
-                form=row['form'],
-                otc=bool(row['otc']),
-                description=row['description'],
-                side_effects=row['side_effects'],
-                category=row['category'],
-                date_added=row['date_added']
+            Medicine.model_construct(
+                name=name,
+                brand=brand,
+                price=price,
+                dosage=dosage,
+                form=form,
+                otc=otc != 0,
+                description=description,
+                side_effects=side_effects,
+                category=category,
+                date_added=date_added
             )
         )
     
-    conn.close()
-    return MedicineDatabase(medicines=medicines)
+    return MedicineDatabase.model_construct(medicines=medicines)
+
+
+def load_medicines_df() -> "pd.DataFrame":
+    """Read the medicines table straight into a DataFrame for display."""
+    # pandas is only needed here, so importing utils stays cheap for the agent and exports
+    import pandas as pd
+
+    with _borrow_read() as conn:
+        return pd.read_sql_query(
+            f"SELECT {', '.join(MEDICINE_COLUMNS)} FROM medicines",
+            conn,
+            dtype={'price': 'float32', 'otc': 'bool'},
+        )
 
 
 def add_insight(insight: MedicineInsight):
     """Add an insight to the database."""
-    conn = sqlite3.connect('medicine.db')
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        'INSERT INTO insights (insight, category, date_created) VALUES (?, ?, ?)',
-        (insight.insight, insight.category, insight.date_created)
-    )
-    
-    conn.commit()
-    conn.close()
+    with _write_transaction() as conn:
+        conn.execute(
+            'INSERT INTO insights (insight, category, date_created) VALUES (?, ?, ?)',
+            (insight.insight, insight.category, insight.date_created)
+        )
 
 
 def get_all_insights() -> list:
     """Retrieve all insights from the database."""
-    conn = sqlite3.connect('medicine.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT * FROM insights')
-    rows = cursor.fetchall()
+    with _borrow_read() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
+        
+        cursor.execute('SELECT * FROM insights')
+        rows = cursor.fetchall()
     
+    # Rows come from our own schema, so skip pydantic validation
     insights = []
     for row in rows:
         insights.append(
-            MedicineInsight(
+            MedicineInsight.model_construct(
                 insight=row['insight'],
                 category=row['category'],
                 date_created=row['date_created']
             )
         )
     
-    conn.close()
     return insights
 
 
+# Position of the otc flag in MEDICINE_COLUMNS rows
+_OTC_INDEX = MEDICINE_COLUMNS.index('otc')
+
+
 def export_to_csv():
-    """Export all medicines to a CSV file."""
-    medicines = get_all_medicines()
-    if medicines.medicines:
-        df = pd.DataFrame([medicine.model_dump() for medicine in medicines.medicines])
-        output_dir = os.getcwd()
-
-        csv_path = os.path.join(output_dir, "medicines.csv")
-        df.to_csv(csv_path, index=False)
+    """Export all medicines to a CSV file, streaming rows straight from the database cursor."""
+    output_dir = os.getcwd()
+    csv_path = os.path.join(output_dir, "medicines.csv")
+
+    with _borrow_read() as conn, open(csv_path, 'w', newline='', encoding='utf-8') as f:
+        cursor = conn.execute(f"SELECT {', '.join(MEDICINE_COLUMNS)} FROM medicines")
+        writer = csv.writer(f)
+        writer.writerow(MEDICINE_COLUMNS)
+        rows_written = 0
+        for row in cursor:
+            # otc is stored as 0/1; write it as True/False like the model
+            writer.writerow(row[:_OTC_INDEX] + (row[_OTC_INDEX] != 0,) + row[_OTC_INDEX + 1:])
+            rows_written += 1
+
+    if rows_written:
         return csv_path
+    os.remove(csv_path)
+    return None
+
+
+# Cached search results are considered fresh for a week
+MEDICINE_CACHE_TTL = 7 * 24 * 60 * 60
+
+
+def normalize_medicine_name(medicine_name: str) -> str:
+    """Normalize a medicine name for use as a cache key."""
+    return re.sub(r"\s+", " ", medicine_name.strip().lower())
+
+
+def get_cached_medicine(medicine_name: str, ttl: float = MEDICINE_CACHE_TTL):
+    """Return the cached Medicine for a name, or None if missing or expired."""
+    with _borrow_read() as conn:
+        row = conn.execute(
+            'SELECT medicine_json FROM medicine_cache WHERE norm_name = ? AND ts > ?',
+            (normalize_medicine_name(medicine_name), time.time() - ttl)
+        ).fetchone()
+    
+    if row:
+        return Medicine.model_validate_json(row[0])
+    return None
+
+
+def cache_medicines(entries: Iterable[Tuple[str, Medicine]]):
+    """Store several (searched name, medicine) pairs in the medicine cache in one transaction."""
+    now = time.time()
+    with _write_transaction() as conn:
+        conn.executemany(
+            'INSERT OR REPLACE INTO medicine_cache (norm_name, medicine_json, ts) VALUES (?, ?, ?)',
+            ((normalize_medicine_name(name), medicine.model_dump_json(), now) for name, medicine in entries)
+        )
+
+
+def cache_medicine(medicine_name: str, medicine: Medicine):
+    """Store a search result in the medicine cache."""
+    cache_medicines([(medicine_name, medicine)])
+
+
+# Leading keywords of statements that modify the database
+_WRITE_KEYWORDS = ('INSERT', 'UPDATE', 'DELETE', 'CREATE', 'ALTER', 'DROP', 'REPLACE', 'TRUNCATE')
+
+# Whitespace and SQL comments allowed before the first keyword
+_SQL_PREFIX = r"^(?:\s|--[^\n]*\n|/\*(?:[^*]|\*+[^*/])*\*+/)*"
+
+_WRITE_RE = re.compile(rf"{_SQL_PREFIX}({'|'.join(_WRITE_KEYWORDS)})\b", re.IGNORECASE)
+
+
+def _compile_write_scanner():
+    """Compile the write keywords into a single Hyperscan database, if available."""
+    if hyperscan is None:
+        return None
+    expressions = [rf"{_SQL_PREFIX}{keyword}\b".encode() for keyword in _WRITE_KEYWORDS]
+    db = hyperscan.Database()
+    db.compile(
+        expressions=expressions,
+        ids=list(range(len(expressions))),
+        elements=len(expressions),
+        flags=[hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_SINGLEMATCH] * len(expressions),
+    )
+    return db
+
+
+_WRITE_SCANNER = _compile_write_scanner()
+
+# A leading WITH clause hides the real statement keyword behind the CTE definitions
+_WITH_RE = re.compile(rf"{_SQL_PREFIX}WITH\b", re.IGNORECASE)
+
+# Comments, quoted strings/identifiers, parentheses and bare words, in source order
+_SQL_TOKEN_RE = re.compile(
+    r"""--[^\n]*|/\*.*?\*/|'(?:[^']|'')*'|"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\]|[()]|[A-Za-z_]\w*""",
+    re.DOTALL,
+)
+
+_STATEMENT_KEYWORDS = {'SELECT', 'VALUES', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE'}
+
+
+def _cte_statement_keyword(query: str) -> Optional[str]:
+    """Return the keyword of the statement that follows a WITH clause, e.g. 'DELETE'."""
+    depth = 0
+    for token in _SQL_TOKEN_RE.findall(query):
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+        elif depth == 0 and token.upper() in _STATEMENT_KEYWORDS:
+            return token.upper()
     return None
+
+
+def _on_write_match(match_id, start, end, flags, context):
+    context.append(match_id)
+
+
+def is_write_query(query: str) -> bool:
+    """Return True if the SQL statement modifies the database, ignoring leading comments.
+
+    Statements starting with a WITH clause are classified by the statement after the CTEs.
+    """
+    if _WITH_RE.match(query):
+        return _cte_statement_keyword(query) in _WRITE_KEYWORDS
+    if _WRITE_SCANNER is None:
+        return _WRITE_RE.match(query) is not None
+    matches = []
+    _WRITE_SCANNER.scan(query.encode(), match_event_handler=_on_write_match, context=matches)
+    return bool(matches)
@@ -0,0 +1,24 @@
+import pytest
+
+from src.utils import is_write_query
+
+
+@pytest.mark.parametrize("query", [
+    "INSERT INTO medicines (name) VALUES ('Aspirin')",
+    "-- note\nupdate medicines SET price = 1",
+    "/* cleanup */ DELETE FROM insights",
+    "WITH t AS (SELECT 1) DELETE FROM medicines WHERE rowid IN (SELECT * FROM t)",
+    "WITH a AS (SELECT 'DELETE'), b AS (SELECT 2) INSERT INTO insights SELECT * FROM a",
+])
+def test_write_queries(query):
+    assert is_write_query(query)
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT * FROM medicines",
+    "SELECT updated_at FROM medicines",
+    "WITH t AS (SELECT 1) SELECT * FROM t",
+    "WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n WHERE x < 5) SELECT x FROM n",
+])
+def test_read_queries(query):
+    assert not is_write_query(query)